@@ -1,12 +1,17 @@
 import json
-import os
+import functools
+import importlib.util
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from datetime import datetime
 import sys
 
+# Use Arrow-backed strings for the id columns when pyarrow is installed
+STRING_DTYPE = 'string[pyarrow]' if importlib.util.find_spec('pyarrow') is not None else 'string'
 
+
+@functools.lru_cache(maxsize=8)
 def load_workflow_config(config_file='workflow_config.json'):
     '''
     Loads the workflow configuration from a JSON file. This includes the workflow run order and dependencies.
@@ -35,24 +40,38 @@ def add_arrows(metrics_df, dependencies):
     - A pandas dataframe containing sorted workflow metrics ordered either by their start time or by their run order. 
     - A dictionary where keys are workflow names and values are lists of workflows that depend on the key workflow. 
     '''
-    arrows = []
-    for workflow, dependent_workflows in dependencies.items():
-        for dep in dependent_workflows:
-            workflow_rows = metrics_df[metrics_df['workflow_name'] == workflow]
-            dep_rows = metrics_df[metrics_df['workflow_name'] == dep]
-        
-            for _, workflow_row in workflow_rows.iterrows():
-                for _, dep_row in dep_rows.iterrows():
-                    workflow_end_time = workflow_row['end_time']
-                    dep_start_time = dep_row['start_time']
-                
-                    arrows.append(go.Scatter(
-                        x=[workflow_end_time, dep_start_time], 
-                        y=[workflow_row['workflow_name_id'], dep_row['workflow_name_id']], 
-                        mode='lines',
-                        line=dict(color='black', width=1, dash='dot'),
-                        showlegend=False
-                    ))
+    present = set(metrics_df['workflow_name'].unique())
+    dep_pairs = pd.DataFrame(
+        [(workflow, dep) for workflow, dependent_workflows in dependencies.items() if workflow in present
+         for dep in dependent_workflows if dep in present],
+        columns=['src', 'dst']
+    )
+    if dep_pairs.empty:
+        return []
+
+    # Join every dependency pair to the end of its source runs and the start of its dependent runs in one pass
+    sources = metrics_df[['workflow_name', 'end_time', 'workflow_name_id']].merge(dep_pairs, left_on='workflow_name', right_on='src')
+    targets = metrics_df[['workflow_name', 'start_time', 'workflow_name_id']]
+    links = sources.merge(targets, left_on='dst', right_on='workflow_name', suffixes=('_src', '_dst'))
+    if links.empty:
+        return []
+
+    # Interleave the arrow endpoints with None so one WebGL trace draws every segment
+    xs = np.full(3 * len(links), None, dtype=object)
+    ys = np.full(3 * len(links), None, dtype=object)
+    xs[0::3] = links['end_time'].to_numpy(dtype=object)
+    xs[1::3] = links['start_time'].to_numpy(dtype=object)
+    ys[0::3] = links['workflow_name_id_src'].to_numpy(dtype=object)
+    ys[1::3] = links['workflow_name_id_dst'].to_numpy(dtype=object)
+
+    arrows = [go.Scattergl(
+        x=xs,
+        y=ys,
+        mode='lines',
+        line=dict(color='black', width=1, dash='dot'),
+        showlegend=False,
+        hoverinfo='skip'
+    )]
 
     return arrows
 
@@ -69,10 +88,12 @@ def update_axes(fig, metrics_df, run_order=None):
     '''
     if run_order:
         tickvals = metrics_df['workflow_name_id'].unique()
-        ticktext = [workflow for workflow in run_order for _ in range(len(metrics_df[metrics_df['workflow_name'] == workflow]))]
+        counts = metrics_df['workflow_name'].value_counts().reindex(run_order, fill_value=0)
+        ticktext = pd.Index(run_order).repeat(counts.to_numpy()).tolist()
+        fig.update_yaxes(categoryorder='array', categoryarray=tickvals)
     else:
-        tickvals = [workflow for workflow in metrics_df['workflow_name_id'].unique()]
-        ticktext = [workflow.split('-')[0] for workflow in metrics_df['workflow_name_id']]
+        tickvals = metrics_df['workflow_name_id'].unique()
+        ticktext = pd.Series(tickvals).str.split('-', n=1).str[0].tolist()
 
     fig.update_yaxes(
         mirror=True,
@@ -114,14 +135,15 @@ def gantt_plot(workflow_metrics, config_file=None, html_file_1='wrt_gantt_v1.htm
     else:
         generate_second_chart = False
 
-    # Convert start_time and end_time to datetime format and create a new column that concatenates workflow names and their run IDs. 
-    workflow_metrics['start_time'] = pd.to_datetime(workflow_metrics['start_time'])
-    workflow_metrics['end_time'] = pd.to_datetime(workflow_metrics['end_time'])
-   
+    # Workflow names repeat across runs, so store them as a categorical to compare, group and sort on integer codes.
+    # Run ids are kept as strings so they concatenate with the vectorized string kernels.
+    workflow_metrics['workflow_name'] = workflow_metrics['workflow_name'].astype('category')
+    workflow_metrics['workflow_run_id'] = workflow_metrics['workflow_run_id'].astype(STRING_DTYPE)
 
-    # Sort based on start times
+    # Sort based on start times and create a new column that concatenates workflow names and their run IDs.
+    # start_time and end_time are expected to already be parsed as datetimes when the metrics are loaded.
     metrics_sorted = workflow_metrics.sort_values(by='start_time')
-    metrics_sorted['workflow_name_id'] = metrics_sorted['workflow_name'] + '-' + metrics_sorted['workflow_run_id']
+    metrics_sorted['workflow_name_id'] = metrics_sorted['workflow_name'].str.cat(metrics_sorted['workflow_run_id'], sep='-')
 
 
     fig_1 = px.timeline(metrics_sorted, 
@@ -155,63 +177,40 @@ def gantt_plot(workflow_metrics, config_file=None, html_file_1='wrt_gantt_v1.htm
                 }
             ]
         )   
-    fig_1.write_html(html_file_1)
+    fig_1.write_html(html_file_1, include_plotlyjs='cdn', validate=False, full_html=True)
 
     # Modify the 'y axis' values based on the run order and sort metrics based on this order
     if generate_second_chart:
         order_map = {workflow: idx for idx, workflow in enumerate(workflow_run_order)}
-        metrics_sorted['run_order_y'] = metrics_sorted['workflow_name'].map(order_map)
+        metrics_sorted['run_order_y'] = metrics_sorted['workflow_name'].map(order_map).astype(float)
         metrics_sorted_run_order = metrics_sorted.sort_values(by=['run_order_y'])
 
-        fig_2 = px.timeline(metrics_sorted_run_order, 
-                        x_start='start_time', 
-                        x_end='end_time', 
-                        y='workflow_name_id', 
-                        color='workflow_run_id',
-        )
-    
-        arrows = add_arrows(metrics_sorted_run_order, dependencies)
-        fig_2.add_traces(arrows)
-
+        # The second chart only differs in its y axis order, so copy the first chart's bars and arrows
+        fig_2 = go.Figure(fig_1)
         update_axes(fig_2, metrics_sorted_run_order, workflow_run_order)
-
-        fig_2.update_layout(
-            title='Interactive Gantt Chart of Workflow Runtime',
-            title_x=0.5,
-            plot_bgcolor='white',
-            showlegend=False,
-            annotations=[
-                {
-                    'text': "Sorted by run order", 
-                    'x': 0.45, 
-                    'y': 1.06, 
-                    'xref': 'paper',
-                    'yref': 'paper',
-                    'showarrow': False,
-                    'font': {'size': 14, 'color': 'grey'},  
-                    'align': 'center' 
-                }
-            ]
-        )
-        fig_2.write_html(html_file_2)
+        fig_2.update_annotations(text="Sorted by run order")
+        fig_2.write_html(html_file_2, include_plotlyjs='cdn', validate=False, full_html=True)
 
         
 
 if __name__ == "__main__":
-    # Check if the user passed the CSV file and optional JSON file as arguments
+    # Check if the user passed the CSV/Parquet file and optional JSON file as arguments
     if len(sys.argv) < 2:
-        print("Usage: python3 plot.py <workflow_metrics.csv> [workflow_config.json]")
+        print("Usage: python3 plot.py <workflow_metrics.csv|workflow_metrics.parquet> [workflow_config.json]")
         exit(1)
 
     csv_file = sys.argv[1]
     config_file = sys.argv[2] if len(sys.argv) > 2 else None
 
-    # Check if the CSV file exists
-    if not os.path.isfile(csv_file):
+    # Parquet keeps the column dtypes, so the metrics do not need to be re-parsed from text
+    try:
+        if csv_file.endswith('.parquet'):
+            workflow_metrics = pd.read_parquet(csv_file)
+        else:
+            workflow_metrics = pd.read_csv(csv_file, parse_dates=['start_time', 'end_time'], dtype={'workflow_run_id': STRING_DTYPE})
+    except FileNotFoundError:
         print(f"Error: The file '{csv_file}' does not exist.")
         exit(1)
 
-    workflow_metrics = pd.read_csv(csv_file)
-
     if workflow_metrics is not None:
         gantt_plot(workflow_metrics, config_file=config_file)
@@ -1,16 +1,122 @@
 import os
 import subprocess
 import json
+import functools
 import re
+import time
+import shutil
+import tempfile
 import csv
 import gzip
-import sys
+import io
+import importlib.metadata
+import multiprocessing
 import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
 import pandas as pd
-import plotly.express as px
-import plotly.io as pio
-import plotly.graph_objects as go
-from datetime import datetime
+# plotly is imported inside the charting functions
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Faster gzip decoders for the File Provenance Report
+try:
+    import rapidgzip
+except ImportError:
+    rapidgzip = None
+
+try:
+    from isal import igzip_threaded
+except ImportError:
+    igzip_threaded = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Prefer orjson for parsing JSON
+try:
+    import orjson
+    jsonLoads = orjson.loads
+except ImportError:
+    jsonLoads = json.loads
+
+# A workflow id on its own line in a TXT input
+WORKFLOW_ID_LINE = re.compile(rb'^[^\S\n]*([A-Za-z0-9\-]+)[^\S\n]*$', re.MULTILINE)
+
+# Per-user directory for cached lookups
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'pipeline-rt')
+
+# Cached workflow metrics are re-queried once they are older than a week
+METRICS_CACHE_TTL = 7 * 24 * 60 * 60
+
+# mongoexport emits ISO 8601 timestamps
+DATE_FORMAT = 'ISO8601' if int(pd.__version__.split('.')[0]) >= 2 else None
+
+# Workflow ids per mongoexport query and number of concurrent queries
+MONGO_BATCH_SIZE = 2000
+MONGO_WORKERS = 3
+
+# Image export processes, each starting its own Kaleido renderer, and the fewest figures worth starting them for
+IMAGE_WORKERS = 2
+IMAGE_POOL_MIN_FIGURES = 8
+
+# Fixed part of the mongoexport command
+MONGO_COMMAND = [
+    "mongoexport",
+    "--host", "workflow-metrics-db.gsi.oicr.on.ca",
+    "--port", "27017",
+    "--username", "workflow_metrics_ro",
+    "--config", "/.mounts/labs/gsi/secrets/workflow-metrics-db.gsi_workflow_metrics_ro",
+    "--db", "workflow_metrics",
+    "--collection", "production_cromwell_workflow_metrics",
+    # Only export the fields parseJson reads
+    "--fields", "workflow_name,start_time,end_time,wallclock_seconds,workflow_run_id"
+]
+
+@functools.lru_cache(maxsize=None)
+def kaleidoVersion():
+    '''
+    Looks up the major version of the installed Kaleido package.
+    Returns
+    -------
+    int: The major version, or 0 if Kaleido is not installed.
+    '''
+    try:
+        return int(importlib.metadata.version('kaleido').split('.')[0])
+    except (importlib.metadata.PackageNotFoundError, ValueError):
+        return 0
+
+
+
+@functools.lru_cache(maxsize=None)
+def kaleidoScope():
+    '''
+    Configures the shared Kaleido scope once so every write_image call reuses one renderer without loading MathJax.
+    Returns
+    -------
+    Optional[PlotlyScope]: The legacy Kaleido scope, or None with Kaleido 1, which has no shared scope and exports batches through pio.write_images instead.
+    '''
+    # plotly 6 still has a deprecated scope under Kaleido 1
+    if kaleidoVersion() >= 1:
+        return None
+
+    import plotly.io as pio
+    scope = getattr(pio.kaleido, 'scope', None)
+    if scope is not None:
+        scope.mathjax = None
+
+    return scope
+
+
 
 def extractWfId(data):
     '''
@@ -22,46 +128,250 @@ def extractWfId(data):
     -------
     List[str]: A list of workflow ids.
     '''
-    workflow_ids = []
-    # Check if data is a dictionary or a list
-    if isinstance(data, dict):
-        for key, value in data.items():
-            if key == 'workflow_id':
-                workflow_ids.append(value)
-            else:
-                workflow_ids.extend(extractWfId(value))
+    workflow_ids = {}
+    stack = deque([data])
+    # Walk the tree in document order; ids are queued as 1-tuples
+    while stack:
+        node = stack.pop()
+        if isinstance(node, tuple):
+            workflow_ids[node[0]] = None
+
+        elif isinstance(node, dict):
+            stack.extend(reversed([(value,) if key == 'workflow_id' else value for key, value in node.items()
+                                   if key == 'workflow_id' or isinstance(value, (dict, list))]))
+
+        elif isinstance(node, list):
+            stack.extend(reversed(node))
+
+    return list(workflow_ids)
+
+
+
+def streamWfId(input_file):
+    '''
+    Incrementally parses a JSON file with ijson and returns the workflow ids found under any 'workflow_id' key.
+    Parameters
+    ----------
+    input_file str: Path to the input JSON file.
+    Returns
+    -------
+    List[str]: A list of workflow ids.
+    '''
+    workflow_ids = {}
+    key = None
+    with open(input_file, 'rb') as file:
+        for _, event, value in ijson.parse(file, use_float=True):
+            if event == 'map_key':
+                key = value
+                continue
+            if key == 'workflow_id' and event in ('string', 'number'):
+                workflow_ids[value] = None
+            key = None
+
+    return list(workflow_ids)
+
+
+
+def openFpr(fp_path):
+    '''
+    Opens the gzipped File Provenance Report as a text stream, using rapidgzip's parallel decoder or ISA-L's igzip when available.
+    Parameters
+    ----------
+    fp_path str: Path to the gzipped File Provenance Report.
+    Returns
+    -------
+    TextIO: A text stream over the decompressed report.
+    '''
+    if rapidgzip is not None:
+        return io.TextIOWrapper(rapidgzip.open(fp_path, parallelization=os.cpu_count()), encoding='utf-8', newline='')
+
+    if igzip_threaded is not None:
+        return igzip_threaded.open(fp_path, 'rt', threads=1, encoding='utf-8', newline='')
+
+    return gzip.open(fp_path, 'rt', encoding='utf-8', newline='')
+
+
+
+def grepFpr(fp_path, workflow_ids):
+    '''
+    Streams the rows of the gzipped File Provenance Report that contain any of the workflow ids, prefiltered by zgrep.
+    Parameters
+    ----------
+    fp_path str: Path to the gzipped File Provenance Report.
+    workflow_ids List[str]: A list of workflow ids to search for in the FP report.
+    Returns
+    -------
+    Iterator[List[str]]: The tab-separated fields of each matching row.
+    '''
+    with tempfile.NamedTemporaryFile('w', suffix='.txt') as ids_file:
+        ids_file.write('\n'.join(map(str, workflow_ids)) + '\n')
+        ids_file.flush()
+        with subprocess.Popen(['zgrep', '-F', '-w', '-f', ids_file.name, fp_path], stdout=subprocess.PIPE, text=True) as proc:
+            yield from csv.reader(proc.stdout, delimiter='\t')
+
+    # zgrep exits with 1 when no line matched and above 1 on errors
+    if proc.returncode > 1:
+        raise subprocess.CalledProcessError(proc.returncode, proc.args)
+
+
+
+def readFprColumns(fp_path):
+    '''
+    Reads the Workflow Run SWID and Root Sample Name columns of the gzipped File Provenance Report with pyarrow's multi-threaded CSV reader, decompressing with rapidgzip when available.
+    Parameters
+    ----------
+    fp_path str: Path to the gzipped File Provenance Report.
+    Returns
+    -------
+    pa.Table: A pyarrow table holding only the two columns.
+    '''
+    options = dict(
+        read_options=pacsv.ReadOptions(block_size=32 << 20),
+        parse_options=pacsv.ParseOptions(delimiter='\t'),
+        convert_options=pacsv.ConvertOptions(
+            include_columns=['Workflow Run SWID', 'Root Sample Name'],
+            column_types={'Workflow Run SWID': pa.string(), 'Root Sample Name': pa.string()}
+        )
+    )
+    # pyarrow decompresses gzip on a single thread
+    if rapidgzip is not None:
+        with rapidgzip.open(fp_path, parallelization=os.cpu_count()) as file:
+            return pacsv.read_csv(file, **options)
+
+    return pacsv.read_csv(fp_path, **options)
+
+
+
+def writeCache(cache_file, write):
+    '''
+    Writes a cache file through a temporary file so a concurrent run never reads it half written.
+    Parameters
+    ----------
+    cache_file str: Path to the cache file.
+    write Callable[[str], None]: A function that writes the cache contents to the path it is given.
+    '''
+    # Each writer gets its own temporary file, so concurrent runs never publish each other's partial writes
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(cache_file), suffix='.tmp')
+        os.close(fd)
+    except OSError as e:
+        print(f"Unable to write cache file {cache_file}: {e}")
+        return
+
+    try:
+        write(tmp_file)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        print(f"Unable to write cache file {cache_file}: {e}")
+    finally:
+        if os.path.exists(tmp_file):
+            os.unlink(tmp_file)
+
+
+
+def loadFprSnapshot(fp_path, workflow_ids):
+    '''
+    Loads the Workflow Run SWID and Root Sample Name rows for a set of workflow ids from a Parquet snapshot of the File Provenance Report, rebuilding the snapshot when the report is newer.
+    Parameters
+    ----------
+    fp_path str: Path to the gzipped File Provenance Report.
+    workflow_ids List[str]: A list of workflow ids to keep.
+    Returns
+    -------
+    Optional[pa.Table]: A pyarrow table holding only the two columns, filtered to the workflow ids, or None if the snapshot is stale and cannot be rebuilt.
+    '''
+    snapshot = os.path.join(CACHE_DIR, os.path.basename(fp_path) + '.swid_sname.parquet')
+    id_filter = pc.is_in(pc.field('Workflow Run SWID'), value_set=pa.array([str(wf) for wf in workflow_ids], type=pa.string()))
+    try:
+        if os.path.getmtime(snapshot) >= os.path.getmtime(fp_path):
+            return pq.read_table(snapshot, filters=id_filter)
+    # A missing snapshot or one left truncated or corrupt is rebuilt from the report
+    except (OSError, pa.ArrowInvalid):
+        pass
+
+    # Only read the whole report if the snapshot can be saved
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+    except OSError:
+        pass
+    if not os.access(CACHE_DIR, os.W_OK):
+        print(f"Unable to cache FPR snapshot in {CACHE_DIR}")
+        return None
+
+    # Sorted by SWID so the row group statistics can skip most of the snapshot
+    table = readFprColumns(fp_path).sort_by('Workflow Run SWID')
+    writeCache(snapshot, lambda path: pq.write_table(table, path))
+
+    return table.filter(id_filter)
+
+
+
+def readFprArrow(fp_path, workflow_ids):
+    '''
+    Reads the sample names for a set of workflow ids from the Parquet snapshot of the File Provenance Report.
+    Parameters
+    ----------
+    fp_path str: Path to the gzipped File Provenance Report.
+    workflow_ids List[str]: A list of workflow ids to search against the FP report.
+    Returns
+    -------
+    Optional[pd.DataFrame]: A pandas dataframe containing extracted sample names and their corresponding workflow ids, or None if the snapshot cannot be used.
+    '''
+    table = loadFprSnapshot(fp_path, workflow_ids)
+    if table is None:
+        return None
 
-    elif isinstance(data, list):
-        for item in data:
-            workflow_ids.extend(extractWfId(item))
+    df = table.to_pandas().rename(columns={'Root Sample Name': 'sample_name', 'Workflow Run SWID': 'workflow_run_id'})
 
-    return list(set(workflow_ids))
+    return df[['sample_name', 'workflow_run_id']].drop_duplicates()
 
 
 
-def queryFpr(fp_path, workflow_ids):
+def queryFpr(fp_path, workflow_ids, use_cache=True):
     '''
     Queries workflow ids against the File Provenance Report to extract sample names.
     Parameters
     ----------
+    fp_path str: Path to the gzipped File Provenance Report.
     workflow_ids List[str]: A list of workflow ids to search against the FP report.
+    use_cache bool: Read through the Parquet snapshot of the report when pyarrow is installed; when False the report is filtered with zgrep and no snapshot is written.
     Returns
     -------
     pd.DataFrame: A pandas dataframe containing extracted sample names and their corresponding workflow ids.
     '''
     print("Extracting records from FPR: " + fp_path)
     sname = []
+    workflow_id_set = set(workflow_ids)
     try:
-        with gzip.open(fp_path, 'rt') as f:
-            reader = csv.DictReader(f, delimiter='\t')
+        # Use the Parquet snapshot when pyarrow is installed, otherwise filter the report with zgrep
+        if pa is not None and use_cache:
+            df = readFprArrow(fp_path, workflow_ids)
+            if df is not None:
+                return df
+
+        # zgrep filters the rows itself, so only the header is read here and needs no parallel decoder
+        use_zgrep = shutil.which('zgrep') is not None
+        with (gzip.open(fp_path, 'rt', encoding='utf-8', newline='') if use_zgrep else openFpr(fp_path)) as f:
+            reader = csv.reader(f, delimiter='\t')
+            header = next(reader)
+            swid_idx = header.index('Workflow Run SWID')
+            sname_idx = header.index('Root Sample Name')
+            if use_zgrep:
+                reader = grepFpr(fp_path, workflow_ids)
+            # Keep each (sample, run) pair only once
+            seen = set()
             for row in reader:
-                if row['Workflow Run SWID'] in workflow_ids:
-                    sname.append({'sample_name': row['Root Sample Name'], 'workflow_run_id': row['Workflow Run SWID']})
+                if row[swid_idx] in workflow_id_set:
+                    key = (row[sname_idx], row[swid_idx])
+                    if key not in seen:
+                        seen.add(key)
+                        sname.append({'sample_name': row[sname_idx], 'workflow_run_id': row[swid_idx]})
         
         if not sname:
             return pd.DataFrame(columns=['sample_name', 'workflow_run_id'])
         
-        df = pd.DataFrame(sname).drop_duplicates()
+        df = pd.DataFrame(sname)
         return df
     
     except Exception as e:
@@ -69,6 +379,28 @@ def queryFpr(fp_path, workflow_ids):
         return None
 
 
+def exportMetrics(workflow_ids):
+    '''
+    Runs a single mongoexport for a batch of workflow ids and parses its line-delimited output.
+    Parameters
+    ----------
+    workflow_ids List[str]: A batch of workflow ids to search against the database.
+    Returns
+    -------
+    List[Dict]: A list of dictionaries containing the exported documents.
+    '''
+    query_str = '{"workflow_run_id": {"$in": ' + json.dumps(workflow_ids) + '}}'
+    command = MONGO_COMMAND + ["--query", query_str]
+    # mongoexport writes one document per line
+    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as proc:
+        docs = [jsonLoads(line) for line in proc.stdout if line.strip()]
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, command)
+
+    return docs
+
+
+
 def queryMongoDB(workflow_ids):
     '''
     Queries a list of workflow ids against a MongoDB Database to return the results as a list of dictionaries.
@@ -77,83 +409,96 @@ def queryMongoDB(workflow_ids):
     workflow_ids List[str]: A list of workflow ids to search against the database.
     Returns
     -------
-    Optional List[Dict]: A list of dictionaries containing the query results, or None if an error occurred. 
+    List[Dict]: A list of dictionaries containing the query results from every batch that succeeded.
     '''
     out = []
-    query_str = '{"workflow_run_id": {"$in": ' + json.dumps(workflow_ids) + '}}'
-    command = [
-        "mongoexport",
-        "--host", "workflow-metrics-db.gsi.oicr.on.ca",
-        "--port", "27017",
-        "--username", "workflow_metrics_ro",
-        "--config", "/.mounts/labs/gsi/secrets/workflow-metrics-db.gsi_workflow_metrics_ro",
-        "--db", "workflow_metrics",
-        "--collection", "production_cromwell_workflow_metrics",
-        "--jsonArray",
-        "--query", query_str
-    ]
-    try:
-        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, text=True)
-        out = json.loads(result.stdout)
+    batches = [workflow_ids[start:start + MONGO_BATCH_SIZE] for start in range(0, len(workflow_ids), MONGO_BATCH_SIZE)]
+    # Batches mostly wait on the network, so run a few at once
+    with ThreadPoolExecutor(max_workers=max(1, min(MONGO_WORKERS, len(batches)))) as pool:
+        futures = [pool.submit(exportMetrics, batch) for batch in batches]
+        for future in futures:
+            try:
+                out.extend(future.result())
 
-    except subprocess.CalledProcessError as e:
-        print(f"Error querying {workflow_id}: {e}")
+            except subprocess.CalledProcessError as e:
+                print(f"Error querying workflow ids: {e}")
 
-    except Exception as e:
-        print(f"Unexpected error while querying {workflow_id}: {e}")
+            except Exception as e:
+                print(f"Unexpected error while querying workflow ids: {e}")
 
     return out
 
 
 
-def parseJson(data, workflow_metrics=None):
+def queryMongoDBCached(workflow_ids):
+    '''
+    Returns the MongoDB documents for a list of workflow ids, only querying the ids without a fresh entry in the on-disk metrics cache.
+    Parameters
+    ----------
+    workflow_ids List[str]: A list of workflow ids to search against the database.
+    Returns
+    -------
+    List[Dict]: A list of dictionaries containing the cached and newly queried documents.
+    '''
+    cache_file = os.path.join(CACHE_DIR, 'workflow_metrics.json.gz')
+    try:
+        with gzip.open(cache_file, 'rb') as file:
+            cache = jsonLoads(file.read())
+    except (OSError, EOFError, ValueError):
+        cache = {}
+
+    now = time.time()
+    cache = {wf: entry for wf, entry in cache.items() if now - entry['fetched'] < METRICS_CACHE_TTL}
+    missing = [wf for wf in workflow_ids if str(wf) not in cache]
+
+    fetched = {}
+    if missing:
+        for doc in queryMongoDB(missing):
+            fetched.setdefault(str(doc.get('workflow_run_id')), []).append(doc)
+        # Only cache runs with both their workflow and provisionFileOut documents, so unfinished runs are queried again
+        cache.update({wf: {'fetched': now, 'docs': docs} for wf, docs in fetched.items()
+                      if {doc.get('workflow_name') == 'provisionFileOut' for doc in docs} == {True, False}})
+
+        def dumpCache(path):
+            with gzip.open(path, 'wt', encoding='utf-8') as file:
+                json.dump(cache, file)
+
+        writeCache(cache_file, dumpCache)
+
+    return [doc for wf in dict.fromkeys(map(str, workflow_ids)) for doc in (cache[wf]['docs'] if wf in cache else fetched.get(wf, []))]
+
+
+
+def parseJson(data):
     '''
     Parses a list of dictionaries to extract workflow metrics and compute the maximum wallclock_seconds for any 'provisionFileOut' step associated with each workflow id.
     Parameters
     ----------
     data List[dict]: A list of dictionaries containing workflow metrics.
-    workflow_metrics Optional[pd.DataFrame]: An empty dataframe to which new rows of extracted workflow metrics will be appended.
     Returns
     -------
     pd.DataFrame: A pandas dataframe containing extracted workflow metrics.
     '''
-    if workflow_metrics is None:
-        columns = ['workflow_name', 'start_time', 'end_time', 'wallclock_seconds', 'workflow_run_id', 'max_provisionFileOut_wallclock_seconds']
-        workflow_metrics = pd.DataFrame(columns=columns)
-
-    grouped_by_run_id = {}
-
-    for workflow in data:
-        workflow_run_id = workflow.get('workflow_run_id')
-        if workflow_run_id not in grouped_by_run_id:
-            grouped_by_run_id[workflow_run_id] = {
-                'workflows': [],
-                'max_provisionFileOut': 0
-            }
-        if workflow.get('workflow_name') == 'provisionFileOut':
-            grouped_by_run_id[workflow_run_id]['max_provisionFileOut'] = max(
-                grouped_by_run_id[workflow_run_id]['max_provisionFileOut'],
-                workflow.get('wallclock_seconds', 0)
-            )
-        else:
-            grouped_by_run_id[workflow_run_id]['workflows'].append(workflow)
-
-    for run_id, group in grouped_by_run_id.items():
-        for wf in group['workflows']:
-            row = {
-                'workflow_name': wf.get('workflow_name'),
-                'start_time': wf.get('start_time'),
-                'end_time': wf.get('end_time'),
-                'wallclock_seconds': wf.get('wallclock_seconds'),
-                'workflow_run_id': run_id,
-                'max_provisionFileOut_wallclock_seconds': group['max_provisionFileOut']
-            }
-            workflow_metrics = pd.concat([workflow_metrics, pd.DataFrame([row])], ignore_index=True)
-
-    return workflow_metrics
+    columns = ['workflow_name', 'start_time', 'end_time', 'wallclock_seconds', 'workflow_run_id', 'max_provisionFileOut_wallclock_seconds']
+    if not data:
+        return pd.DataFrame(columns=columns)
 
+    df = pd.DataFrame.from_records(data, columns=columns[:-1])
+    is_provision = df['workflow_name'] == 'provisionFileOut'
+    max_provision = df.loc[is_provision].groupby('workflow_run_id')['wallclock_seconds'].max().rename(columns[-1])
+    workflow_metrics = df.loc[~is_provision].merge(max_provision, left_on='workflow_run_id', right_index=True, how='left')
+    # Runs without a provisionFileOut step get 0
+    workflow_metrics[columns[-1]] = workflow_metrics[columns[-1]].fillna(0).astype(df['wallclock_seconds'].dtype)
 
+    # Parse the timestamps once for the charts and the Parquet output
+    workflow_metrics['start_time'] = pd.to_datetime(workflow_metrics['start_time'], format = DATE_FORMAT, errors = 'coerce', cache = True)
+    workflow_metrics['end_time'] = pd.to_datetime(workflow_metrics['end_time'], format = DATE_FORMAT, errors = 'coerce', cache = True)
 
+    return workflow_metrics.reset_index(drop=True)
+
+
+
+@functools.lru_cache(maxsize=8)
 def loadConfig(config_file):
     '''
     Loads the workflow run order and dependencies from a JSON file.
@@ -164,38 +509,62 @@ def loadConfig(config_file):
     -------
     Tuple[List[str], Dict[str, List[str]]]: A list of workflows in the specified run order and a dictionary mapping workflow names to their dependencies.
     '''
-    with open(config_file, 'r') as file:
-        config = json.load(file)
+    with open(config_file, 'rb') as file:
+        config = jsonLoads(file.read())
 
     return config['workflow_run_order'], config['dependencies']
 
 
 
-def addArrows(metrics_df, dependencies):
+def addArrows(metrics_df, dependencies, image_format='png'):
     '''
     Creates a list of lines (arrows) linking the different workflows and showing the dependency between them.
     Parameters
     ----------
     metrics_df pd.DataFrame: A pandas dataframe containing sorted workflow metrics.
     dependencies Dict[str, List[str]]: A dictionary where keys are workflow names and values are lists of workflows that depend on the key workflow.
+    image_format str: Format the chart is saved in; HTML charts draw the arrows with WebGL.
     Returns
     -------
-    List[go.Scatter]: A list of Plotly Scatter objects representing the arrows.
+    List[go.Scatter]: A list holding a single scatter trace that draws all of the arrows, or an empty list if there are none.
     '''
+    import plotly.graph_objects as go
+
     arrows = []
-    for workflow, dependent_workflows in dependencies.items():
-        for dep in dependent_workflows:
-            workflow_rows = metrics_df[metrics_df['workflow_name'] == workflow]
-            dep_rows = metrics_df[metrics_df['workflow_name'] == dep]
-            for _, workflow_row in workflow_rows.iterrows():
-                for _, dep_row in dep_rows.iterrows():
-                    arrows.append(go.Scatter(
-                        x=[workflow_row['end_time'], dep_row['start_time']],
-                        y=[workflow_row['workflow_name_id'], dep_row['workflow_name_id']],
-                        mode='lines',
-                        line=dict(color='black', width=1, dash='dot'),
-                        showlegend=False
-                    ))
+    # Only keep the dependency pairs whose workflows both ran
+    present = set(metrics_df['workflow_name'].unique())
+    dep_pairs = pd.DataFrame(
+        [(workflow, dep) for workflow, dependent_workflows in dependencies.items() if workflow in present
+         for dep in dependent_workflows if dep in present],
+        columns=['src', 'dst']
+    )
+    if dep_pairs.empty:
+        return arrows
+
+    sources = metrics_df[['workflow_name', 'end_time', 'workflow_name_id']].merge(dep_pairs, left_on='workflow_name', right_on='src')
+    targets = metrics_df[['workflow_name', 'start_time', 'workflow_name_id']]
+    links = sources.merge(targets, left_on='dst', right_on='workflow_name', suffixes=('_src', '_dst'))
+    if links.empty:
+        return arrows
+
+    # One trace draws every arrow, with None breaking the line between them
+    xs = np.full(3 * len(links), None, dtype=object)
+    ys = np.full(3 * len(links), None, dtype=object)
+    xs[0::3] = links['end_time'].to_numpy(dtype=object)
+    xs[1::3] = links['start_time'].to_numpy(dtype=object)
+    ys[0::3] = links['workflow_name_id_src'].to_numpy(dtype=object)
+    ys[1::3] = links['workflow_name_id_dst'].to_numpy(dtype=object)
+
+    # WebGL only helps in the browser and is rasterized in static exports
+    trace = go.Scattergl if image_format == 'html' else go.Scatter
+    arrows.append(trace(
+        x=xs,
+        y=ys,
+        mode='lines',
+        line=dict(color='black', width=1, dash='dot'),
+        showlegend=False,
+        hoverinfo='skip'
+    ))
 
     return arrows
 
@@ -212,11 +581,13 @@ def updateAxes(fig, metrics_df, run_order=None):
     '''
     if run_order:
         tickvals = metrics_df['workflow_name_id'].unique()
-        ticktext = [workflow for workflow in run_order for _ in range(len(metrics_df[metrics_df['workflow_name'] == workflow]))]
+        counts = metrics_df['workflow_name'].value_counts().reindex(run_order, fill_value=0)
+        ticktext = pd.Index(run_order).repeat(counts.to_numpy()).tolist()
+        fig.update_yaxes(categoryorder='array', categoryarray=tickvals)
     
     else:
-        tickvals = [workflow for workflow in metrics_df['workflow_name_id'].unique()]
-        ticktext = [workflow.split('-')[0] for workflow in metrics_df['workflow_name_id']]
+        tickvals = metrics_df['workflow_name_id'].unique()
+        ticktext = pd.Series(tickvals).str.split('-', n=1).str[0].tolist()
     
     fig.update_yaxes(
         mirror=True,
@@ -255,6 +626,8 @@ def createPlot(df, fig_ht, fig_title, out_png, arrows=None, workflow_run_order=N
     -------
     fig plotly.graph_objects.Figure: The figure object for the Gantt chart.
     ''' 
+    import plotly.express as px
+
     fig = px.timeline(df, 
                       x_start='start_time', 
                       x_end='end_time', 
@@ -264,7 +637,7 @@ def createPlot(df, fig_ht, fig_title, out_png, arrows=None, workflow_run_order=N
                     )
     
     if arrows:
-        fig.addArrows(arrows)
+        fig.add_traces(arrows)
 
     updateAxes(fig, df, workflow_run_order)
 
@@ -280,80 +653,101 @@ def createPlot(df, fig_ht, fig_title, out_png, arrows=None, workflow_run_order=N
 
 
 
-def ganttPlot(workflow_metrics, config_file=None, png_file_1='gantt_v1.png', png_file_2='gantt_v2.png'):
+def saveFigure(fig, out_file, image_format='png'):
     '''
-    Generates two Gantt charts of workflow runtime and saves them as PNG files.
+    Saves a figure as a static PNG/SVG image or as an interactive HTML page.
     Parameters
     ----------
-    workflow_metrics pd.DataFrame: A pandas dataframe containing the workflow metrics.
+    fig go.Figure: The figure object to save.
+    out_file str: The path where the figure should be saved.
+    image_format str: One of 'png', 'svg' or 'html'.
+    '''
+    if image_format == 'html':
+        # HTML is rendered by the browser, so Kaleido is not needed
+        fig.write_html(out_file, include_plotlyjs='cdn', validate=False, full_html=True)
+    else:
+        kaleidoScope()
+        fig.write_image(out_file, format=image_format)
+
+
+
+def ganttPlot(workflow_metrics, config_file=None, png_file_1='gantt_v1.png', png_file_2='gantt_v2.png', image_format='png'):
+    '''
+    Generates two Gantt charts of workflow runtime and saves them as PNG, SVG or HTML files.
+    Parameters
+    ----------
+    workflow_metrics pd.DataFrame: A pandas dataframe containing the workflow metrics, with start_time and end_time parsed as datetimes and workflow_name as a categorical.
     config_file Optional[str]: Path to the workflow configuration file containing run order and dependencies. [Optional]
     png_file_1 str: Path to the first PNG file where the Gantt Chart will be saved.
     png_file_2 str: Path to the second PNG file where the Gantt Chart will be saved.
+    image_format str: Format of the saved charts, one of 'png', 'svg' or 'html'. The file extension follows the format.
     '''
-    generate_second_chart = False
+    import plotly.graph_objects as go
+    import plotly.io as pio
 
-    # Convert start_time and end_time to datetime format  
-    workflow_metrics['start_time'] = pd.to_datetime(workflow_metrics['start_time'], errors = 'coerce')
-    workflow_metrics['end_time'] = pd.to_datetime(workflow_metrics['end_time'], errors = 'coerce')
+    generate_second_chart = False
 
     # Sort based on start times and create a new column that concatenates workflow names and their run IDs.
-    metrics_sorted = workflow_metrics.sort_values(by='start_time')
-    metrics_sorted['workflow_name_id'] = metrics_sorted['workflow_name'] + '-' + metrics_sorted['workflow_run_id']
-
-    num_workflows = len(metrics_sorted['workflow_name_id'].unique())
-    ht = max(400, num_workflows * 30) if num_workflows > 1 else 200
-    unique_samples = workflow_metrics['sample_name'].nunique()
-    arrows_1 = None
-    arrows_2 = None
+    metrics_sorted = workflow_metrics.sort_values(by='start_time').assign(
+        workflow_name_id=lambda df: df['workflow_name'].str.cat(df['workflow_run_id'], sep='-')
+    )
+
+    arrows = None
     workflow_run_order = None
 
     if config_file:
             #Generate the second plot and add dependency links only if workflow dependencies and run order are provided
-            workflow_run_order, dependencies = load_config(config_file)
+            workflow_run_order, dependencies = loadConfig(config_file)
             generate_second_chart = True
             order_map = {workflow: idx for idx, workflow in enumerate(workflow_run_order)}
-            metrics_sorted['run_order_y'] = metrics_sorted['workflow_name'].map(order_map)
+            metrics_sorted = metrics_sorted.assign(run_order_y=metrics_sorted['workflow_name'].map(order_map).astype(float))
             metrics_sorted_run_order = metrics_sorted.sort_values(by=['run_order_y'])
-            #Add dependency links to first plot
-            arrows_1 = addArrows(metrics_sorted, dependencies) 
-            arrows_2 = addArrows(metrics_sorted_run_order, dependencies)
-
-    if unique_samples == 1:
-        sample_name = workflow_metrics['sample_name'].iloc[0]
-        title_1 = f'Gantt Chart of Workflow Runtime (Sample: {sample_name})'
-        fig_1 = createPlot(metrics_sorted, ht, title_1, png_file_1, arrows_1)
-        png = f"{png_file_1.replace('.png', f'_{sample_name}.png')}"
-        fig_1.write_image(png)
-        print(f"Workflow run metrics saved to {png_file_1}")
+
+    if generate_second_chart:
+        run_order_by_sample = dict(tuple(metrics_sorted_run_order.groupby('sample_name', sort=False, observed=True)))
+
+    # Build every figure first so the exports can be batched
+    figures = []
+    for sample, sample_metrics in metrics_sorted.groupby('sample_name', sort=False, observed=True):
+        num_workflows = sample_metrics['workflow_name_id'].nunique()
+        ht = max(400, num_workflows * 30) if num_workflows > 1 else 200
+        title = f'Gantt Chart of Workflow Runtime (Sample: {sample})'
+
+        # Both charts share the same arrows
         if generate_second_chart:
-            title_2 = f'Gantt Chart of Workflow Runtime (Sample: {sample_name})'
-            fig_2 = createPlot(metrics_sorted_run_order, ht, title_2, png_file_2, arrows_2, workflow_run_order)
-            png = f"{png_file_2.replace('.png', f'_{sample_name}.png')}"
-            fig_2.write_image(png)
-            print(f"Workflow run metrics by run order saved to {png_file_2}")
+            arrows = addArrows(sample_metrics, dependencies, image_format)
+
+        # Chart 1
+        sample_png = f"{os.path.splitext(png_file_1)[0]}_{sample}.{image_format}"
+        fig_1_sample = createPlot(sample_metrics, ht, title, sample_png, arrows)
+        figures.append((fig_1_sample, sample_png, f"Workflow run metrics for sample {sample} saved to {sample_png}"))
 
+        if generate_second_chart:
+            # Chart 2 only differs in its y axis order
+            sample_metrics = run_order_by_sample[sample]
+            sample_png = f"{os.path.splitext(png_file_2)[0]}_{sample}.{image_format}"
+            fig_2_sample = go.Figure(fig_1_sample)
+            updateAxes(fig_2_sample, sample_metrics, workflow_run_order)
+            figures.append((fig_2_sample, sample_png, f"Workflow run metrics by run order for sample {sample} saved to {sample_png}"))
+
+    # Kaleido 1 exports a whole batch of images through one browser session
+    if image_format != 'html' and len(figures) > 1 and kaleidoVersion() >= 1 and hasattr(pio, 'write_images'):
+        pio.write_images([fig for fig, _, _ in figures], [out_file for _, out_file, _ in figures], format=image_format, validate=False)
+        for _, _, message in figures:
+            print(message)
+    # Older Kaleido renders one figure at a time, so many figures are exported from a few worker processes.
+    # Each worker starts its own renderer, so fewer figures share the one scope in this process.
+    elif image_format != 'html' and len(figures) >= IMAGE_POOL_MIN_FIGURES:
+        # spawn, as this process already runs the mongoexport, rapidgzip and pyarrow threads
+        with ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = [pool.submit(saveFigure, fig, out_file, image_format) for fig, out_file, _ in figures]
+            for future, (_, _, message) in zip(futures, figures):
+                future.result()
+                print(message)
     else:
-        for sample in workflow_metrics['sample_name'].unique():
-            sample_metrics = metrics_sorted[metrics_sorted['sample_name'] == sample]
-            num_workflows = len(sample_metrics['workflow_name_id'].unique())
-            ht = max(400, num_workflows * 30) if num_workflows > 1 else 200
-            # Chart 1
-            title_sample_1 = f'Gantt Chart of Workflow Runtime (Sample: {sample})'
-            sample_png = f"{png_file_1.replace('.png', f'_{sample}.png')}"
-            fig_1_sample = createPlot(sample_metrics, ht, title_sample_1, sample_png, arrows_1)
-            fig_1_sample.write_image(sample_png)
-            print(f"Workflow run metrics for sample {sample} saved to {sample_png}")
-
-            if generate_second_chart:
-                sample_metrics = metrics_sorted_run_order[metrics_sorted_run_order['sample_name'] == sample]
-                num_workflows = len(sample_metrics['workflow_name_id'].unique())
-                ht = max(400, num_workflows * 30) if num_workflows > 1 else 200
-                # Chart 2
-                title_sample_2 = f'Gantt Chart of Workflow Runtime (Sample: {sample})'
-                sample_png = f"{png_file_2.replace('.png', f'_{sample}.png')}"
-                fig_2_sample = createPlot(sample_metrics,ht, title_sample_2, sample_png, arrows_2, workflow_run_order)
-                fig_2_sample.write_image(sample_png)
-                print(f"Workflow run metrics by run order for sample {sample} saved to {sample_png}")
+        for fig, out_file, message in figures:
+            saveFigure(fig, out_file, image_format)
+            print(message)
 
 
 
@@ -365,49 +759,71 @@ def generateCSV(workflow_metrics, csv_file='workflow_report.csv'):
     workflow_metrics pd.DataFrame: The pandas dataframe containing workflow metrics.
     csv_file str: The CSV filename/path where the metrics are to be stored. 
     '''
-    workflow_metrics.to_csv(csv_file, mode='w', header=True, index=False)
+    workflow_metrics.to_csv(csv_file, mode='w', header=True, index=False, chunksize=10000)
     print(f"Workflow run metrics saved to {csv_file}")
 
+
+
+def generateParquet(workflow_metrics, parquet_file='workflow_report.parquet'):
+    '''
+    Saves workflow metrics data to a Parquet file, preserving column dtypes for re-plotting with plot.py.
+    Parameters
+    ----------
+    workflow_metrics pd.DataFrame: The pandas dataframe containing workflow metrics.
+    parquet_file str: The Parquet filename/path where the metrics are to be stored.
+    '''
+    if pa is None:
+        print(f"Unable to save {parquet_file}: pyarrow is not installed")
+        return
+
+    workflow_metrics.to_parquet(parquet_file, engine='pyarrow', compression='snappy', index=False)
+    print(f"Workflow run metrics saved to {parquet_file}")
+
         
 
-def processInput(input_file, config_file=None):
+def processInput(input_file, config_file=None, parquet=False, plot=True, image_format='png', use_cache=True):
     '''
     Processes an input JSON or Text file to retrieve workflow run ids.
     Parameters
     ----------
     input_file str: Path to an input JSON or Text file that needs to be processed to extract workflow ids.
     config_file Optional[str]: Path to the workflow configuration file containing run order and dependencies. [Optional]
+    parquet bool: Also save the workflow metrics to a Parquet file. [Optional]
+    plot bool: Render the Gantt chart images. [Optional]
+    image_format str: Format of the Gantt charts, one of 'png', 'svg' or 'html'. [Optional]
+    use_cache bool: Use the on-disk FPR snapshot and workflow metrics cache. [Optional]
     '''
-    # Check if file exists
-    if not os.path.isfile(input_file):
-        print(f"File {input_file} not found.")
-        return
-
     # Check if the input is a JSON or TXT file 
     if input_file.endswith('.json'):
         print("Processing JSON for workflow ids")
         try:
-            with open(input_file, 'r') as file:
-                input_data = json.load(file)
-            workflow_ids = extractWfId(input_data)
+            # Stream the ids with ijson when available
+            if ijson is not None:
+                workflow_ids = streamWfId(input_file)
+            else:
+                with open(input_file, 'rb') as file:
+                    input_data = jsonLoads(file.read())
+                workflow_ids = extractWfId(input_data)
+        except FileNotFoundError:
+            print(f"File {input_file} not found.")
+            return
         except Exception as e:
             print(f"Error loading JSON file: {e}")
             return
 
     elif input_file.endswith('.txt'):
         print("Processing TXT for workflow ids")
-        with open(input_file, 'r') as file:
-            lines = file.readlines()
-        header_found = False
-        if lines and re.match(r'^[A-Za-z0-9\-]+$', lines[0].strip()) is None: 
-            header_found = True
-            lines = lines[1:]
-        workflow_ids = []
-        for line in lines:
-            stripped_line = line.strip()
-            if re.match(r'^[A-Za-z0-9\-]+$', stripped_line): 
-                workflow_ids.append(stripped_line)
-        workflow_ids = list(set(workflow_ids))
+        try:
+            with open(input_file, 'rb') as file:
+                text = file.read()
+        except FileNotFoundError:
+            print(f"File {input_file} not found.")
+            return
+        except OSError as e:
+            print(f"Error loading TXT file: {e}")
+            return
+        # Header or malformed lines never match the id pattern
+        workflow_ids = [wf_id.decode() for wf_id in dict.fromkeys(WORKFLOW_ID_LINE.findall(text))]
 
     else:
         print(f"Error: The input must be either '.json' or '.txt' file")
@@ -418,19 +834,23 @@ def processInput(input_file, config_file=None):
         return
     
     fp_path = "/scratch2/groups/gsi/production/vidarr/vidarr_files_report_latest.tsv.gz"
-    df_sname = queryFpr(fp_path, workflow_ids)
+    df_sname = queryFpr(fp_path, workflow_ids, use_cache)
     
     print("Extracting workflow metrics for workflow_ids")
-    data = queryMongoDB(workflow_ids)
+    data = queryMongoDBCached(workflow_ids) if use_cache else queryMongoDB(workflow_ids)
 
     workflow_metrics = None
     if data is not None:
-        workflow_metrics = parseJson(data, workflow_metrics)
+        workflow_metrics = parseJson(data)
 
     if workflow_metrics is not None and df_sname is not None:
         workflow_metrics = pd.merge(workflow_metrics, df_sname, left_on='workflow_run_id', right_on='workflow_run_id', how='left')
-        ganttPlot(workflow_metrics, config_file)
+        workflow_metrics = workflow_metrics.astype({'workflow_name': 'category', 'sample_name': 'category'})
+        if plot:
+            ganttPlot(workflow_metrics, config_file, image_format=image_format)
         generateCSV(workflow_metrics)
+        if parquet:
+            generateParquet(workflow_metrics)
         
 
 if __name__ == "__main__":
@@ -453,6 +873,36 @@ if __name__ == "__main__":
         required = False
     )
 
+    parser.add_argument(
+        '--parquet',
+        action = 'store_true',
+        help = 'Also save the workflow metrics to workflow_report.parquet. Requires pyarrow. [Optional]',
+        required = False
+    )
+
+    parser.add_argument(
+        '--no-plot',
+        action = 'store_true',
+        help = 'Only write the metrics table and skip rendering the Gantt chart images. [Optional]',
+        required = False
+    )
+
+    parser.add_argument(
+        '--format',
+        type = str,
+        choices = ['png', 'svg', 'html'],
+        default = 'png',
+        help = 'Output format of the Gantt charts. SVG skips rasterizing the charts and HTML skips the image renderer entirely. [Optional]',
+        required = False
+    )
+
+    parser.add_argument(
+        '--no-cache',
+        action = 'store_true',
+        help = 'Query MongoDB and the FPR directly instead of using the cached copies under ~/.cache/pipeline-rt. [Optional]',
+        required = False
+    )
+
     # Add custom message to show usage
     parser.epilog = '''
     Example Usage: pipeline-rt -i /path/to/input/JSON 
@@ -469,4 +919,4 @@ if __name__ == "__main__":
         exit(0)
     else:
         print("Reading input")
-        processInput(input_file, config_file = args.config)
+        processInput(input_file, config_file = args.config, parquet = args.parquet, plot = not args.no_plot, image_format = args.format, use_cache = not args.no_cache)